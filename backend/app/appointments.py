@@ -1,16 +1,24 @@
 from datetime import datetime, timezone
-from typing import List, Optional
+from typing import Annotated, List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, Query, status
-from sqlmodel import SQLModel, Session, select
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, status
+from fastapi_cache import FastAPICache
+from fastapi_cache.decorator import cache
+from sqlalchemy import func, insert, literal
+from sqlalchemy.orm import joinedload
+from pydantic import AfterValidator
+from sqlmodel import SQLModel, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from .database import get_session
-from .models import Provider, Appointment, User, PatientProfile, ProviderAppointment
+from .models import Provider, Appointment, User, PatientProfile, ProviderAppointment, utcnow
 from .auth import get_current_user
 from .notification_service import notification_service
 
 router = APIRouter()
 
+PROVIDER_CACHE_NAMESPACE = "providers"
+
 
 # ---------- SCHEMAS ----------
 
@@ -27,10 +35,27 @@ class ProviderRead(SQLModel):
     location: Optional[str]
 
 
+class ProviderSearchRead(ProviderRead):
+    created_at: datetime
+
+
+def as_utc(value: datetime) -> datetime:
+    """
+    Normalize client datetimes to aware UTC. The frontend sends UTC instants;
+    naive values from other clients are taken as UTC.
+    """
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+UTCDatetime = Annotated[datetime, AfterValidator(as_utc)]
+
+
 class AppointmentBook(SQLModel):
     provider_id: int
-    start_time: datetime
-    end_time: datetime
+    start_time: UTCDatetime
+    end_time: UTCDatetime
     reason: Optional[str] = None
 
 class AppointmentRead(SQLModel):
@@ -43,16 +68,51 @@ class AppointmentRead(SQLModel):
 
 
 class AppointmentReschedule(SQLModel):
-    start_time: datetime
-    end_time: datetime
+    start_time: UTCDatetime
+    end_time: UTCDatetime
+
+
+# Columns backing AppointmentRead, so list endpoints skip full ORM hydration
+APPOINTMENT_READ_COLUMNS = (
+    Appointment.id,
+    Appointment.patient_id,
+    Appointment.provider_id,
+    Appointment.start_time,
+    Appointment.end_time,
+    Appointment.status,
+)
+
+
+def _appointment_reads(rows) -> List[AppointmentRead]:
+    return [
+        AppointmentRead.model_construct(
+            id=appt_id,
+            patient_id=patient_id,
+            provider_id=provider_id,
+            start_time=start_time,
+            end_time=end_time,
+            status=status_value,
+        )
+        for appt_id, patient_id, provider_id, start_time, end_time, status_value in rows
+    ]
+
+
+def provider_cache_key(func, namespace: str = "", *, request=None, response=None, args=(), kwargs=None):
+    """
+    Cache key for the provider catalog endpoints.
+    Ignores the per-request session/user dependencies and folds the
+    search term to lowercase, since ILIKE matching is case-insensitive.
+    """
+    q = (kwargs or {}).get("q") or ""
+    return f"{namespace}:{func.__name__}:{q.strip().lower()}"
 
 
 # ---------- PROVIDER ENDPOINTS ----------
 
 @router.post("/providers", response_model=ProviderRead)
-def create_provider(
+async def create_provider(
     provider_in: ProviderCreate,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
     current_user: User = Depends(get_current_user),
 ):
     """
@@ -65,57 +125,81 @@ def create_provider(
         location=provider_in.location,
     )
     session.add(provider)
-    session.commit()
-    session.refresh(provider)
+    await session.commit()
+    await session.refresh(provider)
+    await FastAPICache.clear(namespace=PROVIDER_CACHE_NAMESPACE)
     return provider
 
 
 @router.get("/providers", response_model=List[ProviderRead])
-def list_providers(
-    session: Session = Depends(get_session),
+@cache(expire=60, namespace=PROVIDER_CACHE_NAMESPACE, key_builder=provider_cache_key)
+async def list_providers(
+    session: AsyncSession = Depends(get_session),
     current_user: User = Depends(get_current_user),
 ):
     """
     List all providers (basic search for now).
     """
-    providers = session.exec(select(Provider)).all()
-    return providers
-
-@router.get("/providers/search", response_model=List[Provider])
-def search_providers(
+    stmt = select(Provider.id, Provider.name, Provider.specialty, Provider.location)
+    return [
+        ProviderRead.model_construct(id=provider_id, name=name, specialty=specialty, location=location)
+        for provider_id, name, specialty, location in await session.exec(stmt)
+    ]
+
+@router.get("/providers/search", response_model=List[ProviderSearchRead])
+@cache(expire=30, namespace=PROVIDER_CACHE_NAMESPACE, key_builder=provider_cache_key)
+async def search_providers(
     q: str = Query("", description="Search by provider name"),
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
     current_user: User = Depends(get_current_user),
 ):
     """
     Search providers by partial name match.
     Used by the booking UI when the patient types a name.
     """
+    # Same normalization as provider_cache_key, so a cached entry always
+    # matches the query it stands for (ILIKE already ignores case)
+    q = q.strip()
     stmt = select(Provider)
     if q:
         stmt = stmt.where(Provider.name.ilike(f"%{q}%"))
     stmt = stmt.order_by(Provider.name)
-    return session.exec(stmt).all()
+    return (await session.exec(stmt)).all()
 
 # ---------- APPOINTMENT ENDPOINTS ----------
 
 @router.post("/appointments/book", response_model=Appointment)
 async def book_appointment(
     booking: AppointmentBook,
-    session: Session = Depends(get_session),
+    background_tasks: BackgroundTasks,
+    session: AsyncSession = Depends(get_session),
     current_user: User = Depends(get_current_user),
 ):
     """
     Book an appointment for the current patient with a provider.
     Checks for overlapping appointments for that provider.
     """
-    # Make sure provider exists
-    provider = session.get(Provider, booking.provider_id)
-    if provider is None:
+    # Make sure provider exists, and grab patient details for the notification.
+    # The advisory lock serializes bookings per provider until commit, so the
+    # overlap check in the insert below can't race another booking.
+    lookup_stmt = (
+        select(
+            Provider.name,
+            PatientProfile.full_name,
+            PatientProfile.phone,
+            func.pg_advisory_xact_lock(Provider.id),
+        )
+        .select_from(Provider)
+        .outerjoin(PatientProfile, PatientProfile.user_id == current_user.id)
+        .where(Provider.id == booking.provider_id)
+    )
+    lookup = (await session.exec(lookup_stmt)).first()
+    if lookup is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Provider not found.",
         )
+    provider_name, profile_name, profile_phone, _ = lookup
 
     if booking.start_time >= booking.end_time:
         raise HTTPException(
@@ -123,103 +207,99 @@ async def book_appointment(
             detail="start_time must be before end_time.",
         )
 
-    # Check for overlapping appointments with this provider
-    overlap_stmt = select(Appointment).where(
+    # Insert only if no overlapping appointment exists with this provider
+    overlap = select(Appointment.id).where(
         Appointment.provider_id == booking.provider_id,
         Appointment.status == "booked",
         Appointment.start_time < booking.end_time,
         Appointment.end_time > booking.start_time,
-    )
-    existing = session.exec(overlap_stmt).first()
-    if existing:
+    ).exists()
+
+    table = Appointment.__table__
+    values = {
+        "patient_id": current_user.id,
+        "provider_id": booking.provider_id,
+        "start_time": booking.start_time,
+        "end_time": booking.end_time,
+        "status": "booked",
+        "reason": booking.reason,
+        "created_at": utcnow(),
+    }
+    candidate = select(*(literal(value, table.c[name].type) for name, value in values.items())).where(~overlap)
+    insert_stmt = insert(table).from_select(list(values), candidate).returning(*table.c)
+
+    inserted = (await session.exec(insert_stmt)).first()
+    if inserted is None:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="This time slot is already booked for this provider.",
         )
-
-    appt = Appointment(
-        patient_id=current_user.id,
-        provider_id=booking.provider_id,
-        start_time=booking.start_time,
-        end_time=booking.end_time,
-        status="booked",
-        reason=booking.reason,
+    await session.commit()
+    appt = Appointment(**inserted._mapping)
+
+    # Send notification after the response goes out
+    background_tasks.add_task(
+        notification_service.send_booking_confirmation,
+        patient_phone=profile_phone or "",
+        patient_email=current_user.email,
+        patient_name=profile_name or current_user.email.split('@')[0],
+        appointment_date=appt.start_time,
+        provider_name=provider_name,
     )
-    session.add(appt)
-    session.commit()
-    session.refresh(appt)
-    try:
-        from .models import PatientProfile
-    
-        # Get patient profile for name and phone
-        profile_stmt = select(PatientProfile).where(PatientProfile.user_id == current_user.id)
-        profile = session.exec(profile_stmt).first()
-    
-        patient_name = profile.full_name if (profile and profile.full_name) else current_user.email.split('@')[0]
-        patient_phone = profile.phone if (profile and profile.phone) else ""
-    
-        # Send notification
-        await notification_service.send_booking_confirmation(
-            patient_phone=patient_phone,
-            patient_email=current_user.email,
-            patient_name=patient_name,
-            appointment_date=appt.start_time,
-            provider_name=provider.name
-        )
-        print(f"✅ Notification sent to {current_user.email}")
-    except Exception as e:
-        # Log error but don't fail the booking
-        print(f"⚠️ Failed to send notification: {e}")
 
     return appt
 
-@router.get("/providers/{provider_id}/appointments", response_model=List[Appointment])
-def list_provider_appointments(
+@router.get("/providers/{provider_id}/appointments", response_model=List[AppointmentRead])
+async def list_provider_appointments(
     provider_id: int,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
     current_user: User = Depends(get_current_user),
 ):
     """
     Provider dashboard: list all upcoming appointments for a given provider.
     Used by the booking UI to show which slots are already taken.
     """
-    now = datetime.utcnow()
+    now = utcnow()
     stmt = (
-        select(Appointment)
+        select(*APPOINTMENT_READ_COLUMNS)
         .where(Appointment.provider_id == provider_id)
         .where(Appointment.start_time >= now)
         .order_by(Appointment.start_time)
     )
-    appts = session.exec(stmt).all()
-    return appts
+    return _appointment_reads(await session.exec(stmt))
 
 
 
-@router.get("/appointments/my", response_model=List[Appointment])
-def list_my_appointments(
-    session: Session = Depends(get_session),
+@router.get("/appointments/my", response_model=List[AppointmentRead])
+async def list_my_appointments(
+    session: AsyncSession = Depends(get_session),
     current_user: User = Depends(get_current_user),
 ):
     """
     List all appointments for the current logged-in patient.
     """
-    stmt = select(Appointment).where(Appointment.patient_id == current_user.id)
-    appts = session.exec(stmt).all()
-    return appts
+    stmt = select(*APPOINTMENT_READ_COLUMNS).where(Appointment.patient_id == current_user.id)
+    return _appointment_reads(await session.exec(stmt))
 
 
 @router.put("/appointments/{appointment_id}/reschedule", response_model=Appointment)
 async def reschedule_appointment(
     appointment_id: int,
     body: AppointmentReschedule,
-    session: Session = Depends(get_session),
+    background_tasks: BackgroundTasks,
+    session: AsyncSession = Depends(get_session),
     current_user: User = Depends(get_current_user),
 ):
     """
     Reschedule an existing appointment.
     Only the patient who owns it can reschedule.
     """
-    appt = session.get(Appointment, appointment_id)
+    appt_stmt = (
+        select(Appointment)
+        .options(joinedload(Appointment.provider), joinedload(Appointment.patient_profile))
+        .where(Appointment.id == appointment_id)
+    )
+    appt = (await session.exec(appt_stmt)).first()
     if appt is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -232,27 +312,30 @@ async def reschedule_appointment(
             detail="You can only reschedule your own appointments.",
         )
 
+    # Notification details come from the eager-loaded relationships
+    profile = appt.patient_profile
+    patient_name = profile.full_name if (profile and profile.full_name) else current_user.email.split('@')[0]
+    provider_name = appt.provider.name if appt.provider else "Your provider"
+
     start = body.start_time
     end = body.end_time
 
-    if start.tzinfo is not None:
-        start = start.astimezone(timezone.utc).replace(tzinfo=None)
-    if end.tzinfo is not None:
-        end = end.astimezone(timezone.utc).replace(tzinfo=None)
-
     if start >= end:
         raise HTTPException(status_code=400, detail="start_time must be before end_time")
 
+    # Same per-provider lock as booking, held until commit, so a booking
+    # can't take the slot between this check and the update
+    await session.exec(select(func.pg_advisory_xact_lock(appt.provider_id)))
+
     # Check for overlapping appointment with this provider
-    overlap_stmt = select(Appointment).where(
+    overlap = select(Appointment.id).where(
         Appointment.provider_id == appt.provider_id,
         Appointment.status == "booked",
         Appointment.id != appt.id,
         Appointment.start_time < end,
         Appointment.end_time > start,
-    )
-    existing = session.exec(overlap_stmt).first()
-    if existing:
+    ).exists()
+    if (await session.exec(select(overlap))).first():
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="This time slot is already booked for this provider.",
@@ -261,32 +344,18 @@ async def reschedule_appointment(
     old_start_time = appt.start_time
     appt.start_time = start
     appt.end_time = end
-    session.commit()
-    session.refresh(appt)
-
-    # Send reschedule email
-    try:
-        from .models import PatientProfile
-    
-        # Get patient profile
-        profile_stmt = select(PatientProfile).where(PatientProfile.user_id == current_user.id)
-        profile = session.exec(profile_stmt).first()
-    
-        patient_name = profile.full_name if (profile and profile.full_name) else current_user.email.split('@')[0]
-    
-        # Get provider
-        provider = session.get(Provider, appt.provider_id)
-    
-        await notification_service.send_reschedule_email(
-            patient_email=current_user.email,
-            patient_name=patient_name,
-            old_date=old_start_time,
-            new_date=appt.start_time,
-            provider_name=provider.name if provider else "Your provider"
-        )
-        print(f"✅ Reschedule email sent to {current_user.email}")
-    except Exception as e:
-        print(f"⚠️ Failed to send reschedule email: {e}")
+    await session.commit()
+    await session.refresh(appt)
+
+    # Send reschedule email after the response goes out
+    background_tasks.add_task(
+        notification_service.send_reschedule_email,
+        patient_email=current_user.email,
+        patient_name=patient_name,
+        old_date=old_start_time,
+        new_date=appt.start_time,
+        provider_name=provider_name,
+    )
 
     return appt
 
@@ -294,13 +363,19 @@ async def reschedule_appointment(
 @router.delete("/appointments/{appointment_id}")
 async def cancel_appointment(
     appointment_id: int,
-    session: Session = Depends(get_session),
+    background_tasks: BackgroundTasks,
+    session: AsyncSession = Depends(get_session),
     current_user: User = Depends(get_current_user),
 ):
     """
     Cancel an appointment (soft cancel by setting status).
     """
-    appt = session.get(Appointment, appointment_id)
+    appt_stmt = (
+        select(Appointment)
+        .options(joinedload(Appointment.provider), joinedload(Appointment.patient_profile))
+        .where(Appointment.id == appointment_id)
+    )
+    appt = (await session.exec(appt_stmt)).first()
     if appt is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -313,36 +388,29 @@ async def cancel_appointment(
             detail="You can only cancel your own appointments.",
         )
 
+    # Notification details come from the eager-loaded relationships
+    profile = appt.patient_profile
+    patient_name = profile.full_name if (profile and profile.full_name) else current_user.email.split('@')[0]
+    provider_name = appt.provider.name if appt.provider else "Your provider"
+
     appt.status = "cancelled"
-    session.commit()
-    try:
-        from .models import PatientProfile
-    
-        # Get patient profile
-        profile_stmt = select(PatientProfile).where(PatientProfile.user_id == current_user.id)
-        profile = session.exec(profile_stmt).first()
-    
-        patient_name = profile.full_name if (profile and profile.full_name) else current_user.email.split('@')[0]
-    
-        # Get provider
-        provider = session.get(Provider, appt.provider_id)
-    
-        await notification_service.send_cancellation_email(
-            patient_email=current_user.email,
-            patient_name=patient_name,
-            appointment_date=appt.start_time,
-            provider_name=provider.name if provider else "Your provider"
-        )
-        print(f"✅ Cancellation email sent to {current_user.email}")
-    except Exception as e:
-        print(f"⚠️ Failed to send cancellation email: {e}")
+    await session.commit()
+
+    # Send cancellation email after the response goes out
+    background_tasks.add_task(
+        notification_service.send_cancellation_email,
+        patient_email=current_user.email,
+        patient_name=patient_name,
+        appointment_date=appt.start_time,
+        provider_name=provider_name,
+    )
 
     return {"message": "Appointment cancelled"}
 
 @router.get("/provider-dashboard-list", response_model=list[ProviderAppointment])
-def get_provider_dashboard(
+async def get_provider_dashboard(
     current_user: User = Depends(get_current_user),
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
 ):
     """
     Return all upcoming booked appointments for the current provider,
@@ -375,29 +443,19 @@ def get_provider_dashboard(
         .order_by(Appointment.start_time)
     )
 
-    rows = session.exec(stmt).all()
-
-    results: list[ProviderAppointment] = []
-    for row in rows:
-        (
-            appt_id,
-            start_time,
-            end_time,
-            status_value,
-            reason,
-            full_name,
-        ) = row
-
-        results.append(
-            ProviderAppointment(
-                id=appt_id,
-                start_time=start_time,
-                end_time=end_time,
-                status=status_value,
-                reason=reason,
-                patient_name=full_name,
-            )
+    # Stream from a server-side cursor; rows come straight from typed
+    # columns, so skip per-row validation
+    stmt = stmt.execution_options(yield_per=500)
+    rows = await session.stream(stmt)
+
+    return [
+        ProviderAppointment.model_construct(
+            id=appt_id,
+            start_time=start_time,
+            end_time=end_time,
+            status=status_value,
+            reason=reason,
+            patient_name=full_name,
         )
-
-    return results
-
+        async for appt_id, start_time, end_time, status_value, reason, full_name in rows
+    ]
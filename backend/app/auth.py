@@ -1,27 +1,54 @@
 from datetime import datetime, timedelta
-from typing import Optional
-import re
+from typing import Dict, Optional, Tuple
 
-from fastapi import APIRouter, Depends, HTTPException, status, Request, Form
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, status, Request, Form
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from sqlmodel import SQLModel, Session, select
+from sqlalchemy import or_, update
+from sqlmodel import SQLModel, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from .captcha_service import captcha_service
 from .notification_service import notification_service
 import logging
-from argon2 import PasswordHasher
-from argon2.exceptions import VerifyMismatchError, VerificationError, InvalidHash
 
 from .config import settings
 from .database import get_session
-from .models import User
+from .models import User, utcnow
+from .security import get_password_hash, run_password_op, verify_password
 
-PASSWORD_POLICY = re.compile(r"^(?=.*[a-z])(?=.*[A-Z])(?=.*\d)(?=.*[^A-Za-z0-9]).{12,}$")
+PASSWORD_MIN_LENGTH = 12
+
+# Character class bits tracked by meets_password_policy
+_LOWER, _UPPER, _DIGIT, _SPECIAL = 1, 2, 4, 8
+_ALL_CLASSES = _LOWER | _UPPER | _DIGIT | _SPECIAL
 
 def meets_password_policy(password: str) -> bool:
-    """Check if password meets complexity requirements"""
-    return bool(PASSWORD_POLICY.match(password))
+    """
+    Check if password meets complexity requirements (single pass).
+    Same results as the old ^(?=.*[a-z])(?=.*[A-Z])(?=.*\d)(?=.*[^A-Za-z0-9]).{12,}$
+    pattern, including its quirks: one trailing newline is allowed (and counts
+    as a special character), and non-ASCII digits count as digit and special.
+    """
+    flags = 0
+    if password.endswith("\n"):
+        password = password[:-1]
+        flags = _SPECIAL
+    if len(password) < PASSWORD_MIN_LENGTH:
+        return False
+    for ch in password:
+        if "a" <= ch <= "z":
+            flags |= _LOWER
+        elif "A" <= ch <= "Z":
+            flags |= _UPPER
+        elif "0" <= ch <= "9":
+            flags |= _DIGIT
+        elif ch == "\n":
+            return False
+        elif ch.isdecimal():
+            flags |= _DIGIT | _SPECIAL
+        else:
+            flags |= _SPECIAL
+    return flags == _ALL_CLASSES
 
 
 router = APIRouter()
@@ -32,9 +59,18 @@ SECRET_KEY = settings.SECRET_KEY
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = settings.ACCESS_TOKEN_EXPIRE_MINUTES
 
-ph = PasswordHasher()
+# Session inactivity settings
+SESSION_INACTIVITY_SECONDS = 30  # 30 seconds for testing
+# last_active is only written back to the DB this often; must stay
+# well under SESSION_INACTIVITY_SECONDS so other workers see fresh values
+LAST_ACTIVE_FLUSH_SECONDS = 10
+ACTIVITY_CACHE_MAX = 10_000
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
+# user_id -> (last request seen, last last_active write) in this process
+_activity: Dict[int, Tuple[datetime, datetime]] = {}
+
 
 # --- Pydantic / SQLModel schemas (not DB tables) ---
 
@@ -62,51 +98,41 @@ class TokenData(SQLModel):
 
 # --- Helper functions ---
 
-def get_password_hash(password: str) -> str:
-    return ph.hash(password)
-
-
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    try:
-        # Try Argon2 first
-        return ph.verify(hashed_password, plain_password)
-    except (VerifyMismatchError, VerificationError, InvalidHash):
-        # Fallback to pbkdf2 for existing users
-        try:
-            from passlib.context import CryptContext
-            pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
-            return pwd_context.verify(plain_password, hashed_password)
-        except:
-            return False
-
-
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
-    expire = datetime.utcnow() + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+    expire = utcnow() + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
-def get_user_by_email(session: Session, email: str) -> Optional[User]:
+async def get_user_by_email(session: AsyncSession, email: str) -> Optional[User]:
     statement = select(User).where(User.email == email)
-    result = session.exec(statement)
+    result = await session.exec(statement)
     return result.first()
 
 
-def authenticate_user(session: Session, email: str, password: str) -> Optional[User]:
-    user = get_user_by_email(session, email)
+async def authenticate_user(session: AsyncSession, email: str, password: str) -> Optional[User]:
+    user = await get_user_by_email(session, email)
     if not user:
         return None
-    if not verify_password(password, user.password_hash):
+    if not await run_password_op(verify_password, password, user.password_hash):
         return None
     return user
 
 
+def _remember_activity(user_id: int, seen_at: datetime, written_at: datetime) -> None:
+    if len(_activity) >= ACTIVITY_CACHE_MAX:
+        cutoff = seen_at - timedelta(seconds=SESSION_INACTIVITY_SECONDS)
+        for stale_id in [uid for uid, (seen, _) in _activity.items() if seen < cutoff]:
+            del _activity[stale_id]
+    _activity[user_id] = (seen_at, written_at)
+
+
 # --- Dependencies ---
 
-def get_current_user(
+async def get_current_user(
     token: str = Depends(oauth2_scheme),
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
 ) -> User:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -123,41 +149,55 @@ def get_current_user(
     except (JWTError, ValueError):
         raise credentials_exception
 
-    user = session.get(User, user_id)
+    now = utcnow()
+    cutoff = now - timedelta(seconds=SESSION_INACTIVITY_SECONDS)
+    seen, written = _activity.get(user_id, (None, None))
+
+    if written and (now - written).total_seconds() < LAST_ACTIVE_FLUSH_SECONDS:
+        # We wrote last_active moments ago, so the session can't have expired
+        user = await session.get(User, user_id)
+        if user is None:
+            raise credentials_exception
+        _remember_activity(user_id, now, written)
+        return user
+
+    # Check inactivity and bump last_active in a single UPDATE ... RETURNING.
+    # Skip the inactivity filter if this process saw the user recently, since
+    # the stored value may lag by up to LAST_ACTIVE_FLUSH_SECONDS.
+    stmt = update(User).where(User.id == user_id).values(last_active=now).returning(User)
+    if not (seen and seen > cutoff):
+        stmt = stmt.where(or_(User.last_active.is_(None), User.last_active > cutoff))
+    user = (await session.exec(stmt)).scalars().first()
+
     if user is None:
-        raise credentials_exception
+        user = await session.get(User, user_id)
+        if user is None:
+            raise credentials_exception
+        inactivity_seconds = (now - user.last_active).total_seconds()
+        logger.warning("⏱️ Session expired for %s due to inactivity (%.2f seconds)", user.email, inactivity_seconds)
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Session expired due to inactivity. Please log in again.",
+        )
 
-    if user.last_active:
-        inactivity_seconds = (datetime.utcnow() - user.last_active).total_seconds()
-        print(f"🕐 DEBUG: User {user.email}")
-        print(f"   Last active: {user.last_active}")
-        print(f"   Current time: {datetime.utcnow()}")
-        print(f"   Inactivity: {inactivity_seconds} seconds")
-        
-        if inactivity_seconds > 30:  # 30 seconds for testing
-            logger.warning(f"⏱️ Session expired for {user.email} due to inactivity ({inactivity_seconds} seconds)")
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Session expired due to inactivity. Please log in again.",
-            )
-    else:
-        print(f"🕐 DEBUG: User {user.email} has no last_active timestamp")
-    
-    # Update last active timestamp
-    print(f"   Updating last_active to {datetime.utcnow()}")
-    user.last_active = datetime.utcnow()
-    session.commit()
+    await session.commit()
+    _remember_activity(user_id, now, now)
+    logger.debug("User %s last_active updated to %s", user.email, now)
     return user
 
 
 # --- Routes ---
 
 @router.post("/register", response_model=UserRead)
-async def register(user_in: UserCreate, session: Session = Depends(get_session)):
+async def register(
+    user_in: UserCreate,
+    background_tasks: BackgroundTasks,
+    session: AsyncSession = Depends(get_session),
+):
     """
     Create a new user account. Default role is 'patient'.
     """
-    existing = get_user_by_email(session, user_in.email)
+    existing = await get_user_by_email(session, user_in.email)
     if existing:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -172,20 +212,19 @@ async def register(user_in: UserCreate, session: Session = Depends(get_session))
 
     user = User(
         email=user_in.email,
-        password_hash=get_password_hash(user_in.password),
+        password_hash=await run_password_op(get_password_hash, user_in.password),
         role=user_in.role or "patient",
     )
     session.add(user)
-    session.commit()
-    session.refresh(user)
-    try:
-        await notification_service.send_welcome_email(
-            email=user.email,
-            name=user.email.split('@')[0]
-        )
-        print(f"✅ Welcome email sent to {user.email}")
-    except Exception as e:
-        print(f"⚠️ Failed to send welcome email: {e}")
+    await session.commit()
+    await session.refresh(user)
+
+    # Send welcome email after the response goes out
+    background_tasks.add_task(
+        notification_service.send_welcome_email,
+        email=user.email,
+        name=user.email.split('@')[0],
+    )
 
     return user
 
@@ -195,7 +234,7 @@ async def login(
     request: Request,
     form_data: OAuth2PasswordRequestForm = Depends(),
     recaptcha_token: str = Form(None),
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
 
 ):
 
@@ -207,14 +246,14 @@ async def login(
         remote_ip = request.client.host
         is_valid = await captcha_service.verify_login(recaptcha_token, remote_ip)
         if not is_valid:
-            logger.warning(f"⚠️ CAPTCHA verification failed for {form_data.username} from {remote_ip} - Allowing login for demo")
+            logger.warning("⚠️ CAPTCHA verification failed for %s from %s - Allowing login for demo", form_data.username, remote_ip)
         else:
-            logger.info(f"✅ CAPTCHA verified successfully for {form_data.username}")
+            logger.info("✅ CAPTCHA verified successfully for %s", form_data.username)
     else:
-        logger.info(f"ℹ️ No CAPTCHA token provided for {form_data.username} - CAPTCHA integration ready but blocked by CSP")
+        logger.info("ℹ️ No CAPTCHA token provided for %s - CAPTCHA integration ready but blocked by CSP", form_data.username)
     
     # Get user by email
-    user = get_user_by_email(session, form_data.username)
+    user = await get_user_by_email(session, form_data.username)
     
     if not user:
         raise HTTPException(
@@ -224,31 +263,32 @@ async def login(
         )
     
     # Check if account is locked
-    if user.lockout_until and user.lockout_until > datetime.utcnow():
-        remaining = (user.lockout_until - datetime.utcnow()).total_seconds() / 60
-        logger.warning(f"🔒 Locked account login attempt: {user.email}")
+    now = utcnow()
+    if user.lockout_until and user.lockout_until > now:
+        remaining = (user.lockout_until - now).total_seconds() / 60
+        logger.warning("🔒 Locked account login attempt: %s", user.email)
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail=f"Account locked due to too many failed attempts. Try again in {int(remaining)} minutes.",
         )
     
     # Verify password
-    if not verify_password(form_data.password, user.password_hash):
+    if not await run_password_op(verify_password, form_data.password, user.password_hash):
         # Increment failed attempts
         user.failed_login_attempts += 1
         
         # Lock account after 5 failed attempts
         if user.failed_login_attempts >= 5:
-            user.lockout_until = datetime.utcnow() + timedelta(minutes=15)
-            session.commit()
-            logger.warning(f"🔒 Account locked for {user.email} after 5 failed attempts")
+            user.lockout_until = now + timedelta(minutes=15)
+            await session.commit()
+            logger.warning("🔒 Account locked for %s after 5 failed attempts", user.email)
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="Account locked due to too many failed attempts. Locked for 15 minutes.",
             )
         
-        session.commit()
-        logger.warning(f"⚠️ Failed login attempt {user.failed_login_attempts}/5 for {user.email}")
+        await session.commit()
+        logger.warning("⚠️ Failed login attempt %s/5 for %s", user.failed_login_attempts, user.email)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
@@ -258,10 +298,10 @@ async def login(
     # Successful login - reset failed attempts and lockout
     user.failed_login_attempts = 0
     user.lockout_until = None
-    user.last_active = datetime.utcnow()
-    session.commit()
+    user.last_active = now
+    await session.commit()
     
-    logger.info(f"✅ Successful login for {user.email}")
+    logger.info("✅ Successful login for %s", user.email)
     
     # Create access token
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -271,33 +311,6 @@ async def login(
     )
     
     return Token(access_token=access_token, token_type="bearer")
-    if recaptcha_token:
-        remote_ip = request.client.host
-        is_valid = await captcha_service.verify_login(recaptcha_token, remote_ip)
-        if not is_valid:
-            logger.warning(f"⚠️ CAPTCHA verification failed for {form_data.username} from {remote_ip} - Allowing login for demo")
-        else:
-            logger.info(f"✅ CAPTCHA verified successfully for {form_data.username}")
-    else:
-        logger.info(f"ℹ️ No CAPTCHA token provided for {form_data.username} - CAPTCHA integration ready but blocked by CSP")
-    """
-    Login with email + password using OAuth2PasswordRequestForm.
-    'username' field is treated as email.
-    """
-    user = authenticate_user(session, form_data.username, form_data.password)
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Incorrect email or password.",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": str(user.id)},
-        expires_delta=access_token_expires,
-    )
-    return Token(access_token=access_token, token_type="bearer")
 
 
 @router.get("/me", response_model=UserRead)
@@ -8,18 +8,38 @@ class Settings(BaseSettings):
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60
     BACKEND_CORS_ORIGINS: List[str] = ["http://theboys-web.eng.unt.edu"]
 
+    # Database connection pool settings
+    DB_POOL_SIZE: int = 20
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: int = 30
+    DB_POOL_RECYCLE: int = 3600
+
+    # Serve frontend/ (HTML, CSS, JS) from FastAPI; disable behind nginx/CDN
+    SERVE_STATIC: bool = True
+
+    # Cache settings (in-process cache when no Redis URL is set)
+    REDIS_URL: Optional[str] = None
+    CACHE_PREFIX: str = "easyapt"
+
     # CAPTCHA settings
     RECAPTCHA_SECRET_KEY: Optional[str] = None
     
     # Email settings
     SENDGRID_API_KEY: Optional[str] = None
     SENDGRID_FROM_EMAIL: str = "noreply@easyapt.com"
+    # SendGrid dynamic template used for bulk booking confirmations
+    SENDGRID_BOOKING_TEMPLATE_ID: Optional[str] = None
     
     # SMS settings
     TWILIO_ACCOUNT_SID: Optional[str] = None
     TWILIO_AUTH_TOKEN: Optional[str] = None
     TWILIO_PHONE_NUMBER: Optional[str] = None
+    # Send through a Messaging Service (sender pool) instead of a single number
+    TWILIO_MESSAGING_SERVICE_SID: Optional[str] = None
     
+    # Time zone appointment times are shown in (emails/SMS); stored times are UTC
+    DISPLAY_TIMEZONE: str = "America/Chicago"
+
     # Test mode settings
     TWILIO_TEST_MODE: str = "false"
     MAILTRAP_MODE: str = "false"
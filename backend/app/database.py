@@ -1,20 +1,170 @@
-from sqlmodel import SQLModel, create_engine, Session
+import logging
+
+from typing import List, Tuple
+
+from sqlalchemy import DateTime, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
 from .config import settings
 
+
+def _async_database_url(url: str) -> str:
+    """Point plain/psycopg2 Postgres URLs at the asyncpg driver."""
+    parsed = make_url(url)
+    if parsed.drivername in ("postgresql", "postgresql+psycopg2"):
+        parsed = parsed.set(drivername="postgresql+asyncpg")
+    return parsed.render_as_string(hide_password=False)
+
+
 # For Postgres, connect_args can stay empty
 connect_args = {}
-engine = create_engine(
-    settings.DATABASE_URL,
-    echo=True,
+engine = create_async_engine(
+    _async_database_url(settings.DATABASE_URL),
+    echo=False,
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT,
+    pool_pre_ping=True,
+    pool_recycle=settings.DB_POOL_RECYCLE,
     connect_args=connect_args,
 )
 
+# Keep SQL statement logging off the hot path; only surface warnings
+logging.getLogger("sqlalchemy.engine").setLevel(logging.WARNING)
+
+AsyncSessionLocal = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+
+logger = logging.getLogger(__name__)
+
+# Advisory lock key serializing schema checks/upgrades across workers and
+# migration scripts. It is above the int4 range, so it can't collide with
+# the per-provider booking locks (keyed by provider id).
+SCHEMA_LOCK_KEY = 0x45617379417074  # "EasyApt"
+
+
+async def lock_schema(conn):
+    """Hold the schema advisory lock until conn's transaction ends."""
+    await conn.execute(text(f"SELECT pg_advisory_xact_lock({SCHEMA_LOCK_KEY})"))
+
+
+async def _ensure_profile_user_index(conn):
+    """
+    Upgrade the patientprofile(user_id) index on databases created before it
+    became unique; create_all never touches indexes on existing tables, and
+    the profile upsert's ON CONFLICT (user_id) needs it.
+    """
+    ready = await conn.scalar(text(
+        "SELECT indisunique AND indnatts > indnkeyatts FROM pg_index "
+        "WHERE indexrelid = to_regclass('ix_patientprofile_user_id')"
+    ))
+    if ready:
+        return
+
+    # The old select-then-insert upsert could race into duplicate profiles,
+    # which would stop the unique index from building. Those are patient
+    # records, so cleaning them up is left to an operator.
+    duplicates = await conn.scalar(text(
+        "SELECT count(*) FROM (SELECT user_id FROM patientprofile "
+        "GROUP BY user_id HAVING count(*) > 1) AS dup"
+    ))
+    if duplicates:
+        raise RuntimeError(
+            f"{duplicates} users have more than one patient profile. "
+            "Review and remove them with dedupe_patient_profiles.py before starting the app."
+        )
+
+    await conn.execute(text("DROP INDEX IF EXISTS ix_patientprofile_user_id"))
+    await conn.execute(text(
+        "CREATE UNIQUE INDEX ix_patientprofile_user_id "
+        "ON patientprofile (user_id) INCLUDE (full_name, phone)"
+    ))
+
+
+async def find_naive_timestamp_columns(conn) -> List[Tuple[str, str]]:
+    """
+    (table, column) pairs the models declare as TIMESTAMPTZ that are still
+    TIMESTAMP WITHOUT TIME ZONE in the database (created before the switch).
+    """
+    expected = {
+        (table.name, column.name)
+        for table in SQLModel.metadata.sorted_tables
+        for column in table.columns
+        if isinstance(column.type, DateTime) and column.type.timezone
+    }
+    rows = await conn.execute(text(
+        "SELECT table_name, column_name FROM information_schema.columns "
+        "WHERE table_schema = current_schema() "
+        "AND data_type = 'timestamp without time zone'"
+    ))
+    return [(table_name, column_name) for table_name, column_name in rows.all()
+            if (table_name, column_name) in expected]
+
+
+async def _check_timestamp_columns(conn):
+    """
+    asyncpg rejects tz-aware values for TIMESTAMP WITHOUT TIME ZONE, so every
+    booking would fail. The legacy values aren't all UTC, so converting them
+    is left to migrate_timestamptz.py rather than done here.
+    """
+    naive = await find_naive_timestamp_columns(conn)
+    if naive:
+        columns = ", ".join(f"{table}.{column}" for table, column in naive)
+        raise RuntimeError(
+            f"Timestamp columns without a time zone: {columns}. "
+            "Run migrate_timestamptz.py before starting the app."
+        )
+
+
+# Single-column indexes made redundant by composite indexes that lead
+# with the same column (ix_appt_patient_start, ix_appt_overlap)
+SUPERSEDED_INDEXES = ("ix_appointment_patient_id", "ix_appointment_provider_id")
+
+
+async def _ensure_indexes(conn):
+    """
+    create_all only builds indexes along with a new table, so indexes added
+    to the models later never reach existing databases; create any missing
+    ones and drop the ones they replace.
+    """
+    def create_missing(sync_conn):
+        for table in SQLModel.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(sync_conn, checkfirst=True)
+
+    await conn.run_sync(create_missing)
+    for name in SUPERSEDED_INDEXES:
+        await conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
+
+async def _create_trigram_extension(conn):
+    """
+    The provider-name trigram index needs pg_trgm. Roles without CREATE on
+    the database can't install it; the index is then skipped (see
+    models.pg_trgm_installed) and search falls back to a scan.
+    """
+    try:
+        async with conn.begin_nested():
+            await conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    except DBAPIError as e:
+        logger.warning("Could not create pg_trgm; skipping the provider name trigram index: %s", e.orig)
+
 
-def init_db():
-    SQLModel.metadata.create_all(engine)
+async def init_db():
+    async with engine.begin() as conn:
+        # Workers start together; only one at a time inspects/changes the schema
+        await lock_schema(conn)
+        await _create_trigram_extension(conn)
+        await conn.run_sync(SQLModel.metadata.create_all)
+        await _check_timestamp_columns(conn)
+        await _ensure_profile_user_index(conn)
+        await _ensure_indexes(conn)
 
 
-def get_session():
+async def get_session():
     """Dependency to get a database session for each request."""
-    with Session(engine) as session:
+    async with AsyncSessionLocal() as session:
         yield session
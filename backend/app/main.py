@@ -1,16 +1,27 @@
+import logging
+
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi_cache import FastAPICache
+from fastapi_cache.backends.inmemory import InMemoryBackend
+from fastapi_cache.backends.redis import RedisBackend
+from redis import asyncio as aioredis
 from pathlib import Path
 
+from .config import settings
 from .database import init_db
+from .notification_service import notification_service
 from . import models
 from .auth import router as auth_router
 from .profile import router as profile_router
 from .appointments import router as appointments_router
 
-app = FastAPI(title="EasyApt API")
+# INFO by default, so logger.debug() calls cost only an isEnabledFor check
+logging.basicConfig(level=logging.INFO)
+
+app = FastAPI(title="EasyApt API", default_response_class=ORJSONResponse)
 
 # Add CORS middleware
 app.add_middleware(
@@ -22,8 +33,17 @@ app.add_middleware(
 )
 
 @app.on_event("startup")
-def on_startup():
-    init_db()
+async def on_startup():
+    await init_db()
+    if settings.REDIS_URL:
+        backend = RedisBackend(aioredis.from_url(settings.REDIS_URL))
+    else:
+        backend = InMemoryBackend()
+    FastAPICache.init(backend, prefix=settings.CACHE_PREFIX)
+
+@app.on_event("shutdown")
+def on_shutdown():
+    notification_service.shutdown()
 
 # Include API routers
 app.include_router(auth_router, prefix="/auth", tags=["auth"])
@@ -35,38 +55,41 @@ app.include_router(appointments_router, tags=["appointments & providers"])
 def health_check():
     return {"status": "ok"}
 
-# Path to frontend directory
-frontend_path = Path(__file__).parent.parent.parent / "frontend"
+# Serve the frontend from the app (dev). In production set SERVE_STATIC=false
+# and let nginx/a CDN serve frontend/ directly.
+if settings.SERVE_STATIC:
+    # Path to frontend directory
+    frontend_path = Path(__file__).parent.parent.parent / "frontend"
 
-# Mount static files (CSS, JS)
-app.mount("/css", StaticFiles(directory=str(frontend_path / "css")), name="css")
-app.mount("/js", StaticFiles(directory=str(frontend_path / "js")), name="js")
+    # Mount static files (CSS, JS)
+    app.mount("/css", StaticFiles(directory=str(frontend_path / "css")), name="css")
+    app.mount("/js", StaticFiles(directory=str(frontend_path / "js")), name="js")
 
-# Serve HTML pages
-@app.get("/")
-async def serve_home():
-    return FileResponse(str(frontend_path / "index.html"))
+    # Serve HTML pages
+    @app.get("/")
+    async def serve_home():
+        return FileResponse(str(frontend_path / "index.html"))
 
-@app.get("/login.html")
-async def serve_login():
-    return FileResponse(str(frontend_path / "login.html"))
+    @app.get("/login.html")
+    async def serve_login():
+        return FileResponse(str(frontend_path / "login.html"))
 
-@app.get("/register.html")
-async def serve_register():
-    return FileResponse(str(frontend_path / "register.html"))
+    @app.get("/register.html")
+    async def serve_register():
+        return FileResponse(str(frontend_path / "register.html"))
 
-@app.get("/profile.html")
-async def serve_profile():
-    return FileResponse(str(frontend_path / "profile.html"))
+    @app.get("/profile.html")
+    async def serve_profile():
+        return FileResponse(str(frontend_path / "profile.html"))
 
-@app.get("/appointments.html")
-async def serve_appointments():
-    return FileResponse(str(frontend_path / "appointments.html"))
+    @app.get("/appointments.html")
+    async def serve_appointments():
+        return FileResponse(str(frontend_path / "appointments.html"))
 
-@app.get("/book-appointment.html")
-async def serve_book_appointment():
-    return FileResponse(str(frontend_path / "book-appointment.html"))
+    @app.get("/book-appointment.html")
+    async def serve_book_appointment():
+        return FileResponse(str(frontend_path / "book-appointment.html"))
 
-@app.get("/provider-dashboard.html")
-async def serve_provider_dashboard():
-    return FileResponse(str(frontend_path / "provider-dashboard.html"))
+    @app.get("/provider-dashboard.html")
+    async def serve_provider_dashboard():
+        return FileResponse(str(frontend_path / "provider-dashboard.html"))
@@ -1,46 +1,101 @@
-from datetime import datetime, date
+from datetime import datetime, date, timezone
 from typing import Optional
 
+from sqlalchemy import DateTime, Index
 from sqlmodel import SQLModel, Field, Relationship
 
 
+def utcnow() -> datetime:
+    """Current time as a tz-aware UTC datetime (all timestamps are TIMESTAMPTZ)."""
+    return datetime.now(timezone.utc)
+
+
 class User(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     email: str = Field(index=True, unique=True)
     password_hash: str
     role: str = Field(default="patient")  # patient, provider, staff, admin
-    created_at: datetime = Field(default_factory=datetime.utcnow)
+    created_at: datetime = Field(default_factory=utcnow, sa_type=DateTime(timezone=True))
 
     failed_login_attempts: int = Field(default=0)
-    lockout_until: Optional[datetime] = Field(default=None)
+    lockout_until: Optional[datetime] = Field(default=None, sa_type=DateTime(timezone=True))
 
-    last_active: Optional[datetime] = Field(default=None)
+    last_active: Optional[datetime] = Field(default=None, sa_type=DateTime(timezone=True))
 
 class PatientProfile(SQLModel, table=True):
+    __table_args__ = (
+        # Unique for the profile upsert; INCLUDE lets the booking lookup read
+        # name and phone without visiting the heap
+        Index(
+            "ix_patientprofile_user_id",
+            "user_id",
+            unique=True,
+            postgresql_include=["full_name", "phone"],
+        ),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
-    user_id: int = Field(index=True, foreign_key="user.id")
+    user_id: int = Field(foreign_key="user.id")
     full_name: str
     date_of_birth: date
     phone: str
     insurance: Optional[str] = None
-    created_at: datetime = Field(default_factory=datetime.utcnow)
+    created_at: datetime = Field(default_factory=utcnow, sa_type=DateTime(timezone=True))
+
+def pg_trgm_installed(ddl, target, bind, **kw) -> bool:
+    """DDL condition: only build trigram indexes when pg_trgm is installed."""
+    if bind is None:
+        return True
+    return bind.exec_driver_sql("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'").first() is not None
 
 class Provider(SQLModel, table=True):
+    __table_args__ = (
+        # Trigram index so ILIKE '%q%' provider searches can use an index
+        Index(
+            "ix_provider_name_trgm",
+            "name",
+            postgresql_using="gin",
+            postgresql_ops={"name": "gin_trgm_ops"},
+        ).ddl_if(callable_=pg_trgm_installed),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     name: str
     specialty: Optional[str] = None
     location: Optional[str] = None
-    created_at: datetime = Field(default_factory=datetime.utcnow)
+    created_at: datetime = Field(default_factory=utcnow, sa_type=DateTime(timezone=True))
 
 class Appointment(SQLModel, table=True):
+    __table_args__ = (
+        # Provider overlap checks filter on all four columns
+        Index("ix_appt_overlap", "provider_id", "status", "start_time", "end_time"),
+        # "My appointments" lists by patient, in time order
+        Index("ix_appt_patient_start", "patient_id", "start_time"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
-    patient_id: int = Field(foreign_key="user.id", index=True)
-    provider_id: int = Field(foreign_key="provider.id", index=True)
-    start_time: datetime
-    end_time: datetime
+    # No single-column indexes: ix_appt_patient_start / ix_appt_overlap lead with these
+    patient_id: int = Field(foreign_key="user.id")
+    provider_id: int = Field(foreign_key="provider.id")
+    start_time: datetime = Field(sa_type=DateTime(timezone=True))
+    end_time: datetime = Field(sa_type=DateTime(timezone=True))
     status: str = Field(default="booked")  # booked, cancelled, completed, etc.
     reason: Optional[str] = Field(default=None, max_length=255)
-    created_at: datetime = Field(default_factory=datetime.utcnow)
+    created_at: datetime = Field(default_factory=utcnow, sa_type=DateTime(timezone=True))
+
+    # lazy="raise": async sessions can't lazy-load, so every query that
+    # touches these must eager-load them (joinedload/selectinload)
+    patient: Optional[User] = Relationship(sa_relationship_kwargs={"lazy": "raise"})
+    provider: Optional[Provider] = Relationship(sa_relationship_kwargs={"lazy": "raise"})
+    # Profiles hang off the user, so join through patient_id -> user_id
+    patient_profile: Optional[PatientProfile] = Relationship(
+        sa_relationship_kwargs={
+            "primaryjoin": "foreign(Appointment.patient_id) == remote(PatientProfile.user_id)",
+            "uselist": False,
+            "viewonly": True,
+            "lazy": "raise",
+        }
+    )
 
 class ProviderAppointment(SQLModel):
     id: int
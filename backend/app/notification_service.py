@@ -4,22 +4,48 @@ Handles SMS and Email notifications for appointments
 Author: Emil K
 """
 
+import asyncio
 import os
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from typing import Optional, List
 from enum import Enum
+from functools import cached_property
+from zoneinfo import ZoneInfo
 
-from twilio.rest import Client
-from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from sendgrid.helpers.mail import Mail, Personalization, To
+from sqlalchemy import create_engine, event
+from jinja2 import DictLoader, Environment
+from markupsafe import escape
 import logging
 from .config import settings
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+SENDGRID_SEND_URL = "https://api.sendgrid.com/v3/mail/send"
+HTTP_TIMEOUT_SECONDS = 10
+# SendGrid accepts at most 1000 personalizations per request
+SENDGRID_MAX_PERSONALIZATIONS = 1000
+# Twilio has no batch send; cap concurrent per-message API calls
+BULK_SMS_CONCURRENCY = 5
+
+JOBSTORE_URL = "sqlite:///jobs.sqlite"
+# WAL lets the scheduler read jobs while another connection writes, and the
+# larger mmap/cache cut page faults on the jobs table. Nothing schedules jobs
+# yet, so these only take effect once a caller first uses .scheduler.
+JOBSTORE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA busy_timeout=10000",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA cache_size=-8000",
+    "PRAGMA synchronous=NORMAL",
+)
+
+DISPLAY_TZ = ZoneInfo(settings.DISPLAY_TIMEZONE)
+BOOKING_SMS = "EasyAPT: Your appointment is confirmed for {date_str}. Reply STOP to unsubscribe."
+
 
 class NotificationType(Enum):
     BOOKING_CONFIRMATION = "booking_confirmation"
@@ -28,63 +54,216 @@ class NotificationType(Enum):
     RESCHEDULING = "rescheduling"
 
 
+BOOKING_HTML = """
+        <html>
+            <body style="font-family: Arial, sans-serif;">
+                <h2>Appointment Confirmed</h2>
+                <p>Dear {{ name }},</p>
+                <p>Your appointment has been successfully scheduled:</p>
+                <ul>
+                    <li><strong>Date &amp; Time:</strong> {{ date_str }}</li>
+                    <li><strong>Provider:</strong> {{ provider_name }}</li>
+                </ul>
+                <p>You will receive a reminder 24 hours before your appointment.</p>
+                <br>
+                <p>Best regards,<br>EasyAPT Team</p>
+            </body>
+        </html>
+        """
+
+WELCOME_HTML = """
+        <html>
+            <body style="font-family: Arial, sans-serif;">
+                <h2>Welcome to EasyAPT!</h2>
+                <p>Dear {{ name }},</p>
+                <p>Thank you for creating an account with EasyAPT. Your account has been successfully created.</p>
+                <p>You can now:</p>
+                <ul>
+                    <li>Search for healthcare providers</li>
+                    <li>Book appointments online</li>
+                    <li>Manage your appointment schedule</li>
+                    <li>Update your profile information</li>
+                </ul>
+                <p>Get started by logging in and booking your first appointment!</p>
+                <br>
+                <p>Best regards,<br>EasyAPT Team</p>
+            </body>
+        </html>
+        """
+
+CANCELLATION_HTML = """
+        <html>
+            <body style="font-family: Arial, sans-serif;">
+                <h2>Appointment Cancelled</h2>
+                <p>Dear {{ name }},</p>
+                <p>Your appointment has been cancelled:</p>
+                <ul>
+                    <li><strong>Date &amp; Time:</strong> {{ date_str }}</li>
+                    <li><strong>Provider:</strong> {{ provider_name }}</li>
+                </ul>
+                <p>If you need to schedule a new appointment, please log in to your account.</p>
+                <br>
+                <p>Best regards,<br>EasyAPT Team</p>
+            </body>
+        </html>
+        """
+
+RESCHEDULE_HTML = """
+        <html>
+            <body style="font-family: Arial, sans-serif;">
+                <h2>Appointment Rescheduled</h2>
+                <p>Dear {{ name }},</p>
+                <p>Your appointment has been successfully rescheduled:</p>
+                <ul>
+                    <li><strong>Previous Date &amp; Time:</strong> <s>{{ old_date_str }}</s></li>
+                    <li><strong>New Date &amp; Time:</strong> <span style="color: #10b981; font-weight: bold;">{{ new_date_str }}</span></li>
+                    <li><strong>Provider:</strong> {{ provider_name }}</li>
+                </ul>
+                <p>You will receive a reminder 24 hours before your appointment.</p>
+                <br>
+                <p>Best regards,<br>EasyAPT Team</p>
+            </body>
+        </html>
+        """
+
+# Templates are compiled once per process; autoescape keeps user-supplied
+# names from injecting HTML into emails
+email_templates = Environment(
+    loader=DictLoader({
+        "booking": BOOKING_HTML,
+        "cancellation": CANCELLATION_HTML,
+        "reschedule": RESCHEDULE_HTML,
+    }),
+    autoescape=True,
+)
+
+# The welcome email has a single slot and no logic, so it skips Jinja and is
+# assembled from its static halves split once at import
+_WELCOME_PREFIX, _WELCOME_SUFFIX = WELCOME_HTML.split("{{ name }}")
+
+
+def format_appointment_time(value: datetime) -> str:
+    """Appointment time as patients read it, in the clinic's display time zone."""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(DISPLAY_TZ).strftime("%B %d, %Y at %I:%M %p %Z")
+
+
+def create_jobstore_engine():
+    """SQLite engine for the APScheduler job store, tuned for concurrent access."""
+    engine = create_engine(JOBSTORE_URL, connect_args={"timeout": 10})
+
+    @event.listens_for(engine, "connect")
+    def _apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in JOBSTORE_PRAGMAS:
+            cursor.execute(pragma)
+        cursor.close()
+
+    return engine
+
+
 class NotificationService:
     
     def __init__(self):
         self.twilio_account_sid = settings.TWILIO_ACCOUNT_SID
         self.twilio_auth_token = settings.TWILIO_AUTH_TOKEN
         self.twilio_phone_number = settings.TWILIO_PHONE_NUMBER
+        self.twilio_messaging_service_sid = settings.TWILIO_MESSAGING_SERVICE_SID
         
         self.sendgrid_api_key = settings.SENDGRID_API_KEY
         self.sendgrid_from_email = settings.SENDGRID_FROM_EMAIL
         
-        self.twilio_client = None
-        self.sendgrid_client = None
-        
-        if self.twilio_account_sid and self.twilio_auth_token:
-            self.twilio_client = Client(self.twilio_account_sid, self.twilio_auth_token)
-        else:
+        self._booking_tpl = email_templates.get_template("booking")
+        self._cancellation_tpl = email_templates.get_template("cancellation")
+        self._reschedule_tpl = email_templates.get_template("reschedule")
+
+    # Clients and the scheduler are built on first use, so importing this
+    # module (tests, scripts) doesn't load Twilio/APScheduler or open jobs.sqlite
+
+    @cached_property
+    def http_session(self) -> requests.Session:
+        # One keep-alive pool shared by Twilio and SendGrid, so repeat sends
+        # reuse warm TLS connections. Retries only cover connection errors
+        # (POSTs aren't retried once sent, so no duplicate notifications).
+        session = requests.Session()
+        session.mount(
+            "https://",
+            HTTPAdapter(
+                pool_connections=10,
+                pool_maxsize=50,
+                max_retries=Retry(total=2, backoff_factor=0.2),
+            ),
+        )
+        return session
+
+    @cached_property
+    def twilio_client(self):
+        if not (self.twilio_account_sid and self.twilio_auth_token):
             logger.warning("Twilio credentials not found. SMS notifications disabled.")
-        
-        if self.sendgrid_api_key:
-            self.sendgrid_client = SendGridAPIClient(self.sendgrid_api_key)
-        else:
+            return None
+
+        from twilio.rest import Client
+        from twilio.http.http_client import TwilioHttpClient
+
+        twilio_http = TwilioHttpClient(timeout=HTTP_TIMEOUT_SECONDS)
+        twilio_http.session = self.http_session
+        return Client(self.twilio_account_sid, self.twilio_auth_token, http_client=twilio_http)
+
+    @cached_property
+    def sendgrid_enabled(self) -> bool:
+        # Cached so the missing-key warning is logged once
+        if not self.sendgrid_api_key:
             logger.warning("SendGrid API key not found. Email notifications disabled.")
-        
+            return False
+        return True
+
+    @cached_property
+    def scheduler(self):
+        from apscheduler.schedulers.asyncio import AsyncIOScheduler
+        from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+
         jobstores = {
-            'default': SQLAlchemyJobStore(url='sqlite:///jobs.sqlite')
+            'default': SQLAlchemyJobStore(engine=create_jobstore_engine())
         }
-        self.scheduler = AsyncIOScheduler(jobstores=jobstores)
-        self.scheduler.start()
+        scheduler = AsyncIOScheduler(jobstores=jobstores)
+        scheduler.start()
+        return scheduler
     
     async def send_sms(self, to_phone: str, message: str) -> bool:
         if settings.TWILIO_TEST_MODE.lower() == "true":
-            logger.info(f"[TEST MODE SMS] To: {to_phone} | Message: {message}")
+            logger.info("[TEST MODE SMS] To: %s | Message: %s", to_phone, message)
             return True
 
         if not self.twilio_client:
             logger.error("Twilio client not initialized")
             return False
         
+        if self.twilio_messaging_service_sid:
+            sender = {"messaging_service_sid": self.twilio_messaging_service_sid}
+        else:
+            sender = {"from_": self.twilio_phone_number}
+
         try:
-            message_response = self.twilio_client.messages.create(
+            message_response = await asyncio.to_thread(
+                self.twilio_client.messages.create,
                 body=message,
-                from_=self.twilio_phone_number,
-                to=to_phone
+                to=to_phone,
+                **sender
             )
-            logger.info(f"SMS sent successfully. SID: {message_response.sid}")
+            logger.info("SMS sent successfully. SID: %s", message_response.sid)
             return True
         except Exception as e:
-            logger.error(f"Failed to send SMS: {str(e)}")
+            logger.error("Failed to send SMS: %s", e)
             return False
     
     async def send_email(self, to_email: str, subject: str, html_content: str) -> bool:
         if settings.MAILTRAP_MODE.lower() == "true":
-            logger.info(f"[TEST MODE EMAIL] To: {to_email} | Subject: {subject}")
+            logger.info("[TEST MODE EMAIL] To: %s | Subject: %s", to_email, subject)
             return True
 
-        if not self.sendgrid_client:
-            logger.error("SendGrid client not initialized")
+        if not self.sendgrid_enabled:
+            logger.error("SendGrid not configured")
             return False
         
         try:
@@ -94,13 +273,105 @@ class NotificationService:
                 subject=subject,
                 html_content=html_content
             )
-            response = self.sendgrid_client.send(message)
-            logger.info(f"Email sent successfully. Status: {response.status_code}")
-            return response.status_code in (200, 202)
+            response = await asyncio.to_thread(self._post_to_sendgrid, message)
+            if response.status_code not in (200, 202):
+                logger.error("Failed to send email. Status: %s | %s", response.status_code, response.text)
+                return False
+            logger.info("Email sent successfully. Status: %s", response.status_code)
+            return True
         except Exception as e:
-            logger.error(f"Failed to send email: {str(e)}")
+            logger.error("Failed to send email: %s", e)
             return False
     
+    async def send_email_bulk(self, template_id: str, recipients: List[dict]) -> int:
+        """
+        Send a SendGrid dynamic template to many recipients, one API call per
+        1000 recipients. Each recipient is {"email": ..., "data": {...}}.
+        Returns how many recipients SendGrid accepted.
+        """
+        if settings.MAILTRAP_MODE.lower() == "true":
+            logger.info("[TEST MODE EMAIL] Bulk template %s to %s recipients", template_id, len(recipients))
+            return len(recipients)
+
+        if not self.sendgrid_enabled:
+            logger.error("SendGrid not configured")
+            return 0
+
+        accepted = 0
+        for start in range(0, len(recipients), SENDGRID_MAX_PERSONALIZATIONS):
+            batch = recipients[start:start + SENDGRID_MAX_PERSONALIZATIONS]
+            message = Mail(from_email=self.sendgrid_from_email)
+            message.template_id = template_id
+            for recipient in batch:
+                personalization = Personalization()
+                personalization.add_to(To(recipient["email"]))
+                personalization.dynamic_template_data = recipient["data"]
+                message.add_personalization(personalization)
+
+            try:
+                response = await asyncio.to_thread(self._post_to_sendgrid, message)
+            except Exception as e:
+                logger.error("Failed to send bulk email batch: %s", e)
+                continue
+            if response.status_code not in (200, 202):
+                logger.error("Failed to send bulk email batch. Status: %s | %s", response.status_code, response.text)
+                continue
+            accepted += len(batch)
+
+        logger.info("Bulk email accepted for %s/%s recipients", accepted, len(recipients))
+        return accepted
+
+    async def send_booking_confirmations_bulk(self, entries: List[dict]) -> dict:
+        """
+        Send booking confirmations for many appointments at once.
+        Each entry takes the same keys as send_booking_confirmation.
+        Emails go out in batched SendGrid calls when a dynamic template is
+        configured; SMS is sent per message with bounded concurrency.
+        """
+        recipients = [
+            {
+                "email": entry["patient_email"],
+                "data": {
+                    "name": entry["patient_name"],
+                    "date_str": format_appointment_time(entry["appointment_date"]),
+                    "provider_name": entry["provider_name"],
+                },
+            }
+            for entry in entries
+        ]
+
+        template_id = settings.SENDGRID_BOOKING_TEMPLATE_ID
+        if template_id:
+            emails_sent = await self.send_email_bulk(template_id, recipients)
+        else:
+            # No server-side template: render locally, one send per recipient
+            results = await asyncio.gather(*(
+                self.send_email(
+                    recipient["email"],
+                    "Appointment Confirmation - EasyAPT",
+                    self._booking_tpl.render(**recipient["data"]),
+                )
+                for recipient in recipients
+            ))
+            emails_sent = sum(results)
+
+        sms_limit = asyncio.Semaphore(BULK_SMS_CONCURRENCY)
+
+        async def limited_sms(phone: str, date_str: str) -> bool:
+            async with sms_limit:
+                return await self.send_sms(phone, BOOKING_SMS.format(date_str=date_str))
+
+        sms_results = await asyncio.gather(*(
+            limited_sms(entry["patient_phone"], recipient["data"]["date_str"])
+            for entry, recipient in zip(entries, recipients)
+            if entry.get("patient_phone")
+        ))
+
+        return {
+            "emails_sent": emails_sent,
+            "sms_sent": sum(sms_results),
+        }
+
     async def send_booking_confirmation(
         self, 
         patient_phone: str, 
@@ -109,62 +380,30 @@ class NotificationService:
         appointment_date: datetime,
         provider_name: str
     ) -> dict:
-        date_str = appointment_date.strftime("%B %d, %Y at %I:%M %p")
+        date_str = format_appointment_time(appointment_date)
         
-        sms_message = (
-            f"EasyAPT: Your appointment is confirmed for {date_str}. "
-            f"Reply STOP to unsubscribe."
-        )
+        sms_message = BOOKING_SMS.format(date_str=date_str)
         
         email_subject = "Appointment Confirmation - EasyAPT"
-        email_html = f"""
-        <html>
-            <body style="font-family: Arial, sans-serif;">
-                <h2>Appointment Confirmed</h2>
-                <p>Dear {patient_name},</p>
-                <p>Your appointment has been successfully scheduled:</p>
-                <ul>
-                    <li><strong>Date &amp; Time:</strong> {date_str}</li>
-                    <li><strong>Provider:</strong> {provider_name}</li>
-                </ul>
-                <p>You will receive a reminder 24 hours before your appointment.</p>
-                <br>
-                <p>Best regards,<br>EasyAPT Team</p>
-            </body>
-        </html>
-        """
+        email_html = self._booking_tpl.render(
+            name=patient_name, date_str=date_str, provider_name=provider_name
+        )
         
-        sms_sent = await self.send_sms(patient_phone, sms_message) if patient_phone else False
-        email_sent = await self.send_email(patient_email, email_subject, email_html)
+        # SMS and email are independent, so send them concurrently
+        sms_coro = self.send_sms(patient_phone, sms_message) if patient_phone else asyncio.sleep(0, result=False)
+        email_coro = self.send_email(patient_email, email_subject, email_html)
+        sms_sent, email_sent = await asyncio.gather(sms_coro, email_coro, return_exceptions=True)
         
         return {
-            "sms_sent": sms_sent,
-            "email_sent": email_sent,
+            "sms_sent": sms_sent is True,
+            "email_sent": email_sent is True,
             "reminder_scheduled": False
         }
     async def send_welcome_email(self, email: str, name: str) -> bool:
         """Send welcome email when account is created"""
         
         subject = "Welcome to EasyAPT!"
-        html_content = f"""
-        <html>
-            <body style="font-family: Arial, sans-serif;">
-                <h2>Welcome to EasyAPT!</h2>
-                <p>Dear {name},</p>
-                <p>Thank you for creating an account with EasyAPT. Your account has been successfully created.</p>
-                <p>You can now:</p>
-                <ul>
-                    <li>Search for healthcare providers</li>
-                    <li>Book appointments online</li>
-                    <li>Manage your appointment schedule</li>
-                    <li>Update your profile information</li>
-                </ul>
-                <p>Get started by logging in and booking your first appointment!</p>
-                <br>
-                <p>Best regards,<br>EasyAPT Team</p>
-            </body>
-        </html>
-        """
+        html_content = "".join((_WELCOME_PREFIX, str(escape(name)), _WELCOME_SUFFIX))
         
         return await self.send_email(email, subject, html_content)
     
@@ -177,25 +416,12 @@ class NotificationService:
     ) -> bool:
         """Send email when appointment is cancelled"""
         
-        date_str = appointment_date.strftime("%B %d, %Y at %I:%M %p")
+        date_str = format_appointment_time(appointment_date)
         
         subject = "Appointment Cancelled - EasyAPT"
-        html_content = f"""
-        <html>
-            <body style="font-family: Arial, sans-serif;">
-                <h2>Appointment Cancelled</h2>
-                <p>Dear {patient_name},</p>
-                <p>Your appointment has been cancelled:</p>
-                <ul>
-                    <li><strong>Date &amp; Time:</strong> {date_str}</li>
-                    <li><strong>Provider:</strong> {provider_name}</li>
-                </ul>
-                <p>If you need to schedule a new appointment, please log in to your account.</p>
-                <br>
-                <p>Best regards,<br>EasyAPT Team</p>
-            </body>
-        </html>
-        """
+        html_content = self._cancellation_tpl.render(
+            name=patient_name, date_str=date_str, provider_name=provider_name
+        )
         
         return await self.send_email(patient_email, subject, html_content)
     
@@ -209,32 +435,35 @@ class NotificationService:
     ) -> bool:
         """Send email when appointment is rescheduled"""
         
-        old_date_str = old_date.strftime("%B %d, %Y at %I:%M %p")
-        new_date_str = new_date.strftime("%B %d, %Y at %I:%M %p")
+        old_date_str = format_appointment_time(old_date)
+        new_date_str = format_appointment_time(new_date)
         
         subject = "Appointment Rescheduled - EasyAPT"
-        html_content = f"""
-        <html>
-            <body style="font-family: Arial, sans-serif;">
-                <h2>Appointment Rescheduled</h2>
-                <p>Dear {patient_name},</p>
-                <p>Your appointment has been successfully rescheduled:</p>
-                <ul>
-                    <li><strong>Previous Date &amp; Time:</strong> <s>{old_date_str}</s></li>
-                    <li><strong>New Date &amp; Time:</strong> <span style="color: #10b981; font-weight: bold;">{new_date_str}</span></li>
-                    <li><strong>Provider:</strong> {provider_name}</li>
-                </ul>
-                <p>You will receive a reminder 24 hours before your appointment.</p>
-                <br>
-                <p>Best regards,<br>EasyAPT Team</p>
-            </body>
-        </html>
-        """
+        html_content = self._reschedule_tpl.render(
+            name=patient_name,
+            old_date_str=old_date_str,
+            new_date_str=new_date_str,
+            provider_name=provider_name,
+        )
         
         return await self.send_email(patient_email, subject, html_content)    
 
+    def _post_to_sendgrid(self, message: Mail) -> requests.Response:
+        # The SendGrid SDK sends through urllib with no connection reuse,
+        # so we post its Mail payloads through the pooled session instead
+        return self.http_session.post(
+            SENDGRID_SEND_URL,
+            json=message.get(),
+            headers={"Authorization": f"Bearer {self.sendgrid_api_key}"},
+            timeout=HTTP_TIMEOUT_SECONDS,
+        )
+
     def shutdown(self):
-        self.scheduler.shutdown()
+        # Only tear down what was actually started
+        if "scheduler" in self.__dict__:
+            self.scheduler.shutdown()
+        if "http_session" in self.__dict__:
+            self.http_session.close()
 
 
 notification_service = NotificationService()
@@ -2,10 +2,12 @@ from datetime import date
 from typing import Optional
 
 from fastapi import APIRouter, Depends
-from sqlmodel import SQLModel, Session, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlmodel import SQLModel, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from .database import get_session
-from .models import PatientProfile, User
+from .models import PatientProfile, User, utcnow
 from .auth import get_current_user
 
 router = APIRouter()
@@ -28,8 +30,8 @@ class PatientProfileUpdate(SQLModel):
 
 
 @router.get("/me", response_model=Optional[PatientProfileRead])
-def get_my_profile(
-    session: Session = Depends(get_session),
+async def get_my_profile(
+    session: AsyncSession = Depends(get_session),
     current_user: User = Depends(get_current_user),
 ):
     """
@@ -37,36 +39,28 @@ def get_my_profile(
     Returns null if no profile exists yet.
     """
     statement = select(PatientProfile).where(PatientProfile.user_id == current_user.id)
-    return session.exec(statement).first()
+    return (await session.exec(statement)).first()
 
 
 @router.put("/me", response_model=PatientProfileRead)
-def upsert_my_profile(
+async def upsert_my_profile(
     profile_in: PatientProfileUpdate,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
     current_user: User = Depends(get_current_user),
 ):
     """
     Create or update the current patient's profile.
     """
-    statement = select(PatientProfile).where(PatientProfile.user_id == current_user.id)
-    profile = session.exec(statement).first()
-
-    if profile is None:
-        profile = PatientProfile(
-            user_id=current_user.id,
-            full_name=profile_in.full_name,
-            date_of_birth=profile_in.date_of_birth,
-            phone=profile_in.phone,
-            insurance=profile_in.insurance,
-        )
-        session.add(profile)
-    else:
-        profile.full_name = profile_in.full_name
-        profile.date_of_birth = profile_in.date_of_birth
-        profile.phone = profile_in.phone
-        profile.insurance = profile_in.insurance
-
-    session.commit()
-    session.refresh(profile)
+    # Single atomic INSERT ... ON CONFLICT (user_id) DO UPDATE, so concurrent
+    # PUTs can't both insert a profile
+    fields = profile_in.model_dump()
+    statement = (
+        pg_insert(PatientProfile)
+        .values(user_id=current_user.id, created_at=utcnow(), **fields)
+        .on_conflict_do_update(index_elements=["user_id"], set_=fields)
+        .returning(PatientProfile)
+        .execution_options(populate_existing=True)
+    )
+    profile = (await session.exec(statement)).scalar_one()
+    await session.commit()
     return profile
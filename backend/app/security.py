@@ -0,0 +1,43 @@
+"""
+Password hashing helpers for EasyAPT
+Kept free of web/notification imports so scripts can use them cheaply
+"""
+import os
+from typing import Callable, Optional, TypeVar
+
+import anyio
+from argon2 import PasswordHasher
+from argon2.exceptions import VerifyMismatchError, VerificationError, InvalidHash
+from passlib.context import CryptContext
+
+ph = PasswordHasher()
+pbkdf2_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
+
+# Argon2 is CPU (and memory) bound, so cap concurrent hashes at the core count
+_password_limiter: Optional[anyio.CapacityLimiter] = None
+
+T = TypeVar("T")
+
+
+def get_password_hash(password: str) -> str:
+    return ph.hash(password)
+
+
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    try:
+        # Try Argon2 first
+        return ph.verify(hashed_password, plain_password)
+    except (VerifyMismatchError, VerificationError, InvalidHash):
+        # Fallback to pbkdf2 for existing users
+        try:
+            return pbkdf2_context.verify(plain_password, hashed_password)
+        except:
+            return False
+
+
+async def run_password_op(func: Callable[..., T], *args) -> T:
+    """Run a password hash/verify in a worker thread so the event loop stays free."""
+    global _password_limiter
+    if _password_limiter is None:
+        _password_limiter = anyio.CapacityLimiter(os.cpu_count() or 1)
+    return await anyio.to_thread.run_sync(func, *args, limiter=_password_limiter)
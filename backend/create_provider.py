@@ -1,27 +1,25 @@
+import asyncio
 import sys
 sys.path.insert(0, '/home/mjr0315@students.ad.unt.edu/EasyApt/backend')
 
-from app.database import engine
+from app.database import AsyncSessionLocal, engine
 from app.models import User, Provider
-from passlib.context import CryptContext
-from sqlmodel import Session, select
+from app.security import get_password_hash, run_password_op
+from sqlalchemy import update
+from sqlmodel import select
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
-def create_provider(email: str, password: str, name: str):
+async def create_provider(email: str, password: str, name: str):
     """Create a provider account"""
-    hashed_password = pwd_context.hash(password)
-    
-    with Session(engine) as session:
-        # Check if user already exists
-        statement = select(User).where(User.email == email)
-        existing = session.exec(statement).first()
-        
-        if existing:
-            print(f"User {email} already exists. Updating to provider role...")
-            existing.role = "provider"
-            session.add(existing)
-            session.commit()
+    hashed_password = await run_password_op(get_password_hash, password)
+
+    # One transaction for both rows: a single commit, and no User left
+    # without its Provider if the script dies halfway
+    async with AsyncSessionLocal() as session, session.begin():
+        # Promote an existing user in place; rowcount tells us whether one exists
+        statement = update(User).where(User.email == email).values(role="provider")
+        result = await session.exec(statement)
+
+        if result.rowcount:
             print(f"✅ Updated {email} to provider role!")
         else:
             # Create new provider user
@@ -31,31 +29,33 @@ def create_provider(email: str, password: str, name: str):
                 role="provider"
             )
             session.add(new_user)
-            session.commit()
             print(f"✅ Created new provider user: {email}")
-        
+
         # Check if provider profile exists
-        provider_statement = select(Provider).where(Provider.name == name)
-        provider_profile = session.exec(provider_statement).first()
-        
-        if not provider_profile:
+        provider_statement = select(Provider.id).where(Provider.name == name)
+        provider_id = (await session.exec(provider_statement)).first()
+
+        if provider_id is None:
             provider_profile = Provider(
                 name=name,
                 specialty="General Practice"
             )
             session.add(provider_profile)
-            session.commit()
             print(f"✅ Created provider profile for {name}")
         else:
             print(f"✅ Provider profile already exists for {name}")
 
-if __name__ == "__main__":
-    create_provider(
+async def main():
+    await create_provider(
         email="dr.smith@example.com",
         password="provider123",
         name="Dr. Sarah Smith"
     )
-    
+    await engine.dispose()
+
+if __name__ == "__main__":
+    asyncio.run(main())
+
     print("\n" + "="*50)
     print("Provider account ready!")
     print("Email: dr.smith@example.com")
@@ -0,0 +1,52 @@
+"""
+Find users with more than one patient profile (left by the old
+select-then-insert upsert) so the unique patientprofile(user_id) index can
+build. Lists them by default; pass --apply to keep each user's newest
+profile and delete the rest.
+
+    python dedupe_patient_profiles.py           # review
+    python dedupe_patient_profiles.py --apply   # delete older duplicates
+"""
+import asyncio
+import sys
+
+from app.database import engine, lock_schema
+from sqlalchemy import text
+
+async def dedupe_profiles(apply: bool):
+    """Report, and optionally delete, duplicate patient profiles"""
+    async with engine.begin() as conn:
+        await lock_schema(conn)
+        rows = (await conn.execute(text(
+            "SELECT user_id, id, full_name, phone, created_at FROM patientprofile "
+            "WHERE user_id IN (SELECT user_id FROM patientprofile "
+            "GROUP BY user_id HAVING count(*) > 1) "
+            "ORDER BY user_id, id DESC"
+        ))).all()
+
+        if not rows:
+            print("✅ No duplicate patient profiles")
+            return
+
+        kept_users = set()
+        for user_id, profile_id, full_name, phone, created_at in rows:
+            action = "keep" if user_id not in kept_users else "delete"
+            kept_users.add(user_id)
+            print(f"user {user_id}: profile {profile_id} ({full_name}, {phone}, {created_at}) -> {action}")
+
+        if not apply:
+            print("\nNothing deleted. Re-run with --apply to delete the profiles marked 'delete'.")
+            return
+
+        result = await conn.execute(text(
+            "DELETE FROM patientprofile p USING patientprofile newer "
+            "WHERE p.user_id = newer.user_id AND p.id < newer.id"
+        ))
+        print(f"✅ Deleted {result.rowcount} duplicate profiles")
+
+async def main(apply: bool):
+    await dedupe_profiles(apply)
+    await engine.dispose()
+
+if __name__ == "__main__":
+    asyncio.run(main("--apply" in sys.argv[1:]))
@@ -1,34 +1,35 @@
+import asyncio
 import sys
 sys.path.insert(0, '/home/mjr0315@students.ad.unt.edu/EasyApt/backend')
 
-from app.database import engine
+from app.database import AsyncSessionLocal, engine
 from app.models import User
-from passlib.context import CryptContext
-from sqlmodel import Session, select
+from app.security import get_password_hash, run_password_op
+from sqlalchemy import update
 
-# Use the SAME password context as auth.py
-pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
-
-def fix_provider_password(email: str, new_password: str):
+async def fix_provider_password(email: str, new_password: str):
     """Fix the provider's password with correct hash"""
-    hashed_password = pwd_context.hash(new_password)
-    
-    with Session(engine) as session:
-        statement = select(User).where(User.email == email)
-        user = session.exec(statement).first()
-        
-        if not user:
+    hashed_password = await run_password_op(get_password_hash, new_password)
+
+    async with AsyncSessionLocal() as session:
+        # Direct UPDATE; rowcount tells us whether the user exists
+        statement = update(User).where(User.email == email).values(password_hash=hashed_password)
+        result = await session.exec(statement)
+
+        if result.rowcount == 0:
             print(f"❌ User {email} not found!")
             return
-        
-        user.password_hash = hashed_password
-        session.add(user)
-        session.commit()
+
+        await session.commit()
         print(f"✅ Fixed password for {email}")
 
+async def main():
+    await fix_provider_password("dr.smith@example.com", "provider123")
+    await engine.dispose()
+
 if __name__ == "__main__":
-    fix_provider_password("dr.smith@example.com", "provider123")
-    
+    asyncio.run(main())
+
     print("\n" + "="*50)
     print("Provider password fixed!")
     print("Email: dr.smith@example.com")
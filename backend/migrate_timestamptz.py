@@ -0,0 +1,58 @@
+"""
+One-off migration for databases created before timestamps became TIMESTAMPTZ.
+
+The old frontend sent appointment start_time as the browser's local time with
+no zone, and end_time as UTC; every other timestamp was written as UTC. Pass
+the time zone the clinic's browsers were in:
+
+    python migrate_timestamptz.py America/Chicago
+"""
+import asyncio
+import sys
+from zoneinfo import ZoneInfo
+
+from app import models  # noqa: F401  (registers the tables on SQLModel.metadata)
+from app.database import engine, find_naive_timestamp_columns, lock_schema
+from sqlalchemy import text
+
+# Columns the old frontend filled with browser-local wall-clock times
+LOCAL_TIME_COLUMNS = {("appointment", "start_time")}
+
+async def migrate_timestamps(legacy_timezone: str):
+    """Convert naive timestamp columns to TIMESTAMPTZ"""
+    ZoneInfo(legacy_timezone)  # reject unknown zone names before touching data
+    # ALTER TABLE can't take bind parameters, so the zone is inlined as a literal
+    legacy_literal = "'" + legacy_timezone.replace("'", "''") + "'"
+
+    async with engine.begin() as conn:
+        await lock_schema(conn)
+        naive = await find_naive_timestamp_columns(conn)
+        if not naive:
+            print("✅ All timestamp columns are already TIMESTAMPTZ")
+            return
+
+        quote = conn.dialect.identifier_preparer.quote
+        for table_name, column_name in naive:
+            zone = legacy_literal if (table_name, column_name) in LOCAL_TIME_COLUMNS else "'UTC'"
+            column = quote(column_name)
+            await conn.execute(text(
+                f"ALTER TABLE {quote(table_name)} ALTER COLUMN {column} "
+                f"TYPE TIMESTAMPTZ USING {column} AT TIME ZONE {zone}"
+            ))
+            print(f"✅ Converted {table_name}.{column_name} (from {zone})")
+
+        inverted = await conn.scalar(text(
+            "SELECT count(*) FROM appointment WHERE end_time <= start_time"
+        ))
+        if inverted:
+            print(f"⚠️  {inverted} appointments end before they start; check the time zone and review them")
+
+async def main(legacy_timezone: str):
+    await migrate_timestamps(legacy_timezone)
+    await engine.dispose()
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python migrate_timestamptz.py <legacy IANA time zone, e.g. America/Chicago>")
+        sys.exit(1)
+    asyncio.run(main(sys.argv[1]))
@@ -247,6 +247,24 @@ export function clearMessage(elementId) {
   }
 }
 
+/**
+ * Convert a local wall-clock time ('YYYY-MM-DDTHH:MM:SS') to the UTC ISO
+ * string the API expects
+ */
+export function toApiDateTime(localDateTime) {
+  return new Date(localDateTime).toISOString();
+}
+
+/**
+ * Local calendar date ('YYYY-MM-DD') of an ISO string or Date
+ */
+export function localDateKey(value) {
+  const date = value instanceof Date ? value : new Date(value);
+  const month = String(date.getMonth() + 1).padStart(2, '0');
+  const day = String(date.getDate()).padStart(2, '0');
+  return `${date.getFullYear()}-${month}-${day}`;
+}
+
 /**
  * Format date/time for display
  */